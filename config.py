@@ -1,9 +1,39 @@
-import os
 import logging
-from dotenv import load_dotenv
+from typing import Annotated, List
 
-# Load .env file if present
-load_dotenv()
+from pydantic import field_validator
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """Environment-driven settings, parsed and type-checked once at import (.env is read if present)"""
+    # env_ignore_empty: a blank variable (DEBUG=) means the default, as the old os.getenv parsing did
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore", frozen=True, env_ignore_empty=True)
+
+    host: str = "0.0.0.0"
+    port: int = 8000
+    debug: bool = False
+    # comma-separated in the environment, e.g. ALLOWED_ORIGINS=https://a.com,https://b.com
+    allowed_origins: Annotated[List[str], NoDecode] = ["*"]
+    data_dir: str = "data"
+    log_level: str = "INFO"
+    static_cache_max_age: int = 31536000
+    ws_compress: bool = False
+
+    @field_validator("allowed_origins", mode="before")
+    @classmethod
+    def _split_origins(cls, value):
+        if isinstance(value, str):
+            return value.split(",")
+        return value
+
+    @field_validator("log_level")
+    @classmethod
+    def _upper_log_level(cls, value: str) -> str:
+        return value.upper()
+
+
+settings = Settings()
 
 # -------------------
 # App Configurations
@@ -12,20 +42,29 @@ APP_NAME = "WebRTC Video Call Server"
 APP_VERSION = "1.0.0"
 
 # Server settings
-HOST = os.getenv("HOST", "0.0.0.0")
-PORT = int(os.getenv("PORT", 8000))
-DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+HOST = settings.host
+PORT = settings.port
+DEBUG = settings.debug
+
+# permessage-deflate on WebSockets. Off by default: SDP/ICE frames are small and
+# high-entropy, so zlib costs CPU per frame for little wire saving.
+WS_COMPRESS = settings.ws_compress
 
 # Allowed CORS origins (default: all)
-ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
+ALLOWED_ORIGINS = settings.allowed_origins
 
 # Data storage folder
-DATA_DIR = os.getenv("DATA_DIR", "data")
+DATA_DIR = settings.data_dir
+
+# Browser cache lifetime for /static assets. Pages link assets with a content-hash query,
+# so a changed file gets a new URL. In production prefer serving /static from nginx/Caddy
+# with the same header so asset requests never reach Python.
+STATIC_CACHE_CONTROL = f"public, max-age={settings.static_cache_max_age}, immutable"
 
 # -------------------
 # Logging Configuration
 # -------------------
-LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVEL = settings.log_level
 
 logging.basicConfig(
     level=LOG_LEVEL,
@@ -0,0 +1,13 @@
+from config import DATA_DIR
+from repos.file_storage_manager_repo import FileStorageManager
+from service.connection_manager_service import ConnectionManager
+from service.recorder_service import RecorderManager
+
+# -------------------
+# Shared app state
+# -------------------
+# One instance of each, imported by every endpoint module so REST, WebSocket
+# and health routes all see the same rooms and live connections.
+storage = FileStorageManager(DATA_DIR)
+manager = ConnectionManager(storage)
+recorder = RecorderManager(base_dir="recordings")
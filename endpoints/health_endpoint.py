@@ -1,18 +1,27 @@
+import time
+
+import orjson
 from fastapi import APIRouter
+from fastapi.responses import Response
 
-from repos.file_storage_manager_repo import FileStorageManager
-from service.connection_manager_service import ConnectionManager
+from deps import manager
 
 router = APIRouter(tags=["Health"])
 
-storage = FileStorageManager()
-manager = ConnectionManager(storage)
+# Probes hit /health every few seconds from every LB/k8s node; serve the same encoded
+# body for HEALTH_TTL seconds instead of rebuilding it on each hit.
+HEALTH_TTL = 0.5
+_HEALTH_CACHE = {"ts": float("-inf"), "payload": b""}
 
 
 @router.get("/health")
 async def health_check():
-    return {
-        "status": "healthy",
-        "active_rooms": len(manager.active_connections),
-        "total_connections": sum(len(users) for users in manager.active_connections.values())
-    }
+    now = time.monotonic()
+    if now - _HEALTH_CACHE["ts"] > HEALTH_TTL:
+        _HEALTH_CACHE["payload"] = orjson.dumps({
+            "status": "healthy",
+            "active_rooms": len(manager.active_connections),
+            "total_connections": manager.total_connections
+        })
+        _HEALTH_CACHE["ts"] = now
+    return Response(content=_HEALTH_CACHE["payload"], media_type="application/json")
@@ -1,23 +1,58 @@
-from fastapi import APIRouter
-from fastapi.responses import FileResponse
+import hashlib
+import re
+
+from fastapi import APIRouter, Request
+from fastapi.responses import Response
 from pathlib import Path
 
 router = APIRouter(tags=["Pages"])
 
 ROOT = Path(__file__).resolve().parents[1]  # points to app/
 STATIC_DIR = ROOT / "static"
+ROOM_HTML = str(STATIC_DIR / "room.html")
+INDEX_HTML = str(STATIC_DIR / "index.html")
 
 
-@router.get("/", include_in_schema=False)
-def get_join_page():
-    return FileResponse(str(STATIC_DIR / "room.html"))
+def _file_hash(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def _versioned_asset(match: re.Match) -> bytes:
+    """Append ?v=<content hash> to a /static link so long-lived caching never serves a stale asset"""
+    name = match.group(1)
+    asset = STATIC_DIR / name.decode()
+    if not asset.is_file():
+        return match.group(0)
+    return b'"/static/%b?v=%b"' % (name, _file_hash(asset).encode())
+
+
+def _load_page(path: str) -> tuple:
+    """Read an HTML page once and tag it with a content-hash ETag"""
+    with open(path, "rb") as f:
+        content = re.sub(rb'"/static/([\w.-]+)"', _versioned_asset, f.read())
+    return content, f'"{hashlib.sha1(content).hexdigest()}"'
 
 
+# Served from memory for the life of the process; restart to pick up edits
+ROOM_PAGE = _load_page(ROOM_HTML)
+INDEX_PAGE = _load_page(INDEX_HTML)
+
+
+def _page_response(request: Request, page: tuple) -> Response:
+    content, etag = page
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content, media_type="text/html", headers={"ETag": etag})
+
+
+@router.get("/", include_in_schema=False)
 @router.get("/join", include_in_schema=False)
-def get_join_page_explicit():
-    return FileResponse(str(STATIC_DIR / "room.html"))
+async def get_join_page(request: Request):
+    return _page_response(request, ROOM_PAGE)
 
 
 @router.get("/room/{room_id}", include_in_schema=False)
-def get_room_interface(room_id: str):
-    return FileResponse(str(STATIC_DIR / "index.html"))
+async def get_room_interface(request: Request, room_id: str):
+    return _page_response(request, INDEX_PAGE)
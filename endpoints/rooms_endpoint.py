@@ -1,20 +1,23 @@
+import asyncio
+
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import ORJSONResponse
 
 from models.room_models import CreateRoomRequest, JoinRoomRequest, MediaStatusUpdate
-import json
+from models.signal_models import user_media_changed
+import orjson
 
-from repos.file_storage_manager_repo import FileStorageManager
-from service.connection_manager_service import ConnectionManager
+from deps import storage, manager
 
 router = APIRouter(prefix="/api/rooms", tags=["Rooms"])
 
-storage = FileStorageManager()
-manager = ConnectionManager(storage)
+# Constant control frame, encoded once at import
+ROOM_ENDED = orjson.dumps({"type": "room-ended", "message": "Room has been ended by host"})
 
 
 @router.post("")
 async def create_room(request: CreateRoomRequest):
-    room_id = storage.create_room(request.max_participants)
+    room_id = await storage.create_room(request.max_participants)
     return {"room_id": room_id, "join_url": f"/room/{room_id}", "max_participants": request.max_participants}
 
 
@@ -24,39 +27,36 @@ async def get_room_info(room_id: str):
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     participants = storage.get_room_participants(room_id)
-    return {
+    return ORJSONResponse(content={
         "room_id": room_id,
         "participants": participants,
         "participant_count": len(participants),
         "max_participants": room["max_participants"],
         "created_at": room["created_at"]
-    }
+    })
 
 
 @router.post("/{room_id}/join")
 async def join_room_api(room_id: str, request: JoinRoomRequest):
-    return storage.join_room(room_id, request.display_name)
+    return await storage.join_room(room_id, request.display_name)
 
 
 @router.patch("/{room_id}/users/{user_id}/media")
 async def update_media_status(room_id: str, user_id: str, request: MediaStatusUpdate):
-    storage.update_media_status(room_id, user_id, request.audio_enabled, request.video_enabled)
-    message = json.dumps({"type": "user-media-changed", "user_id": user_id,
-                          "audio_enabled": request.audio_enabled, "video_enabled": request.video_enabled})
-    await manager.broadcast_to_room(message, room_id, exclude_user=user_id)
+    if await storage.update_media_status(room_id, user_id, request.audio_enabled, request.video_enabled):
+        manager.update_media(room_id, user_id, request.audio_enabled, request.video_enabled)
+        message = user_media_changed(user_id, request.audio_enabled, request.video_enabled)
+        await manager.broadcast_to_room(message, room_id, exclude_user=user_id)
     return {"message": "Media status updated"}
 
 
 @router.delete("/{room_id}")
 async def end_room(room_id: str):
     if room_id in manager.active_connections:
-        end_message = json.dumps({"type": "room-ended", "message": "Room has been ended by host"})
-        await manager.broadcast_to_room(end_message, room_id)
+        await manager.broadcast_to_room(ROOM_ENDED, room_id)
         connections = list(manager.active_connections[room_id].values())
-        for connection in connections:
-            try:
-                await connection.close()
-            except:
-                pass
-        del manager.active_connections[room_id]
+        # close() waits for each socket's queued frames, room-ended included, to go out first
+        await asyncio.gather(*(manager.close(connection) for connection in connections), return_exceptions=True)
+        # the closed sockets may already have dropped the room via disconnect()
+        manager.drop_room(room_id)
     return {"message": "Room ended successfully"}
@@ -1,95 +1,156 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
-import json, logging
+import asyncio
+import logging
 
-from repos.file_storage_manager_repo import FileStorageManager
-from service.connection_manager_service import ConnectionManager
+import orjson
+from pydantic import ValidationError
+
+from deps import storage, manager, recorder
+from models.signal_models import SignalMessage, MT_USER_SCREEN_SHARE_CHANGED, MT_RECORDER_ANSWER, user_media_changed
 
 router = APIRouter(tags=["WebSocket"])
 
-storage = FileStorageManager()
-manager = ConnectionManager(storage)
 logger = logging.getLogger(__name__)
-# add at top with other imports
-from service.recorder_service import RecorderManager
 
-recorder = RecorderManager(base_dir="recordings")
+# Constant control frames, encoded once at import
+ERR_INVALID_JSON = orjson.dumps({"type": "error", "message": "Invalid JSON format"})
+RECORDER_STOPPED = orjson.dumps({"type": "recorder-stopped"})
+
+# Strong refs to fire-and-forget teardown tasks; the loop only keeps weak ones
+_background_tasks = set()
+
+
+def _with_from_user(message: SignalMessage, raw: bytes, user_id: str) -> bytes:
+    """Relay the client's frame as-is with from_user spliced in before the closing brace.
+
+    SDP/ICE frames can be several KB, so this skips a full re-encode. The frame already
+    validated as a JSON object; model_dump is only the fallback for an empty object.
+    """
+    end = raw.rfind(b"}")
+    if end <= 0 or not (message.model_fields_set or message.model_extra):
+        payload = message.model_dump(exclude_unset=True)
+        payload["from_user"] = user_id
+        return orjson.dumps(payload)
+    # a later duplicate key wins in JSON.parse, same as overwriting a client-sent from_user
+    return b"%b,\"from_user\":%b%b" % (raw[:end], orjson.dumps(user_id), raw[end:])
+
+
+# Original WebRTC handling + Screen sharing WebRTC
+async def _forward_to_peer(message: SignalMessage, raw: bytes, room_id: str, user_id: str, websocket: WebSocket):
+    if message.to_user:
+        await manager.send_to_user(_with_from_user(message, raw, user_id), room_id, message.to_user)
+
+
+async def _media_toggle(message: SignalMessage, raw: bytes, room_id: str, user_id: str, websocket: WebSocket):
+    audio_enabled = message.audio_enabled
+    video_enabled = message.video_enabled
+    if not await storage.update_media_status(room_id, user_id, audio_enabled, video_enabled):
+        return  # same state as before; peers already have it
+    manager.update_media(room_id, user_id, audio_enabled, video_enabled)
+    await manager.broadcast_to_room(
+        user_media_changed(user_id, audio_enabled, video_enabled),
+        room_id, exclude_user=user_id
+    )
+
+
+# Screen sharing status updates
+async def _screen_share_status(message: SignalMessage, raw: bytes, room_id: str, user_id: str, websocket: WebSocket):
+    is_sharing = message.type == "screen-share-started"
+    await manager.broadcast_to_room(
+        orjson.dumps({"type": MT_USER_SCREEN_SHARE_CHANGED, "user_id": user_id,
+                      "is_sharing": is_sharing}),
+        room_id, exclude_user=user_id
+    )
+
+
+async def _recorder_offer(message: SignalMessage, raw: bytes, room_id: str, user_id: str, websocket: WebSocket):
+    # { type:"recorder-offer", sdp:"...", sdpType:"offer" }
+    answer = await recorder.start_or_renegotiate(room_id, user_id, message.sdp, message.sdpType)
+    manager.send(websocket, orjson.dumps({
+        "type": MT_RECORDER_ANSWER,
+        "sdp": answer["sdp"],
+        "sdpType": answer["type"]
+    }))
 
 
+async def _recorder_ice_candidate(message: SignalMessage, raw: bytes, room_id: str, user_id: str, websocket: WebSocket):
+    # { type:"recorder-ice-candidate", candidate: {candidate, sdpMid, sdpMLineIndex} | null }
+    await recorder.add_ice(room_id, user_id, message.candidate)
+
+
+async def _recorder_stop(message: SignalMessage, raw: bytes, room_id: str, user_id: str, websocket: WebSocket):
+    await recorder.stop(room_id, user_id)
+    manager.send(websocket, RECORDER_STOPPED)
+
+
+async def _broadcast_default(message: SignalMessage, raw: bytes, room_id: str, user_id: str, websocket: WebSocket):
+    await manager.broadcast_to_room(_with_from_user(message, raw, user_id), room_id, exclude_user=user_id)
+
+
+# Built once at import; unknown types fall through to _broadcast_default
+HANDLERS = {
+    "webrtc-offer": _forward_to_peer,
+    "webrtc-answer": _forward_to_peer,
+    "ice-candidate": _forward_to_peer,
+    "screen-share-offer": _forward_to_peer,
+    "screen-share-answer": _forward_to_peer,
+    "screen-share-ice-candidate": _forward_to_peer,
+    "media-toggle": _media_toggle,
+    "screen-share-started": _screen_share_status,
+    "screen-share-stopped": _screen_share_status,
+    "recorder-offer": _recorder_offer,
+    "recorder-ice-candidate": _recorder_ice_candidate,
+    "recorder-stop": _recorder_stop,
+}
+
+
+async def _safe_recorder_stop(room_id: str, user_id: str):
+    try:
+        await recorder.stop(room_id, user_id)
+    except Exception:
+        logger.exception(f"Error stopping recorder for user {user_id} in room {room_id}")
+
 
 @router.websocket("/ws/{room_id}/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
     try:
-        participants = storage.get_room_participants(room_id)
-        user_info = next((p for p in participants if p["user_id"] == user_id), None)
+        user_info = storage.get_room_participants_map(room_id).get(user_id)
         if not user_info:
             await websocket.close(code=4004, reason="User not found in room")
             return
 
-        await manager.connect(websocket, room_id, user_id, user_info["display_name"])
+        await manager.connect(websocket, room_id, user_id, user_info["display_name"],
+                              user_info["is_audio_enabled"], user_info["is_video_enabled"])
 
         while True:
-            data = await websocket.receive_text()
+            # Take text and binary frames alike and work on bytes end to end
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000), frame.get("reason"))
+            data = frame.get("bytes")
+            if data is None:
+                data = frame["text"].encode()
+            try:
+                message = SignalMessage.model_validate_json(data)
+            except ValidationError:
+                manager.send(websocket, ERR_INVALID_JSON)
+                continue
+
+            handler = HANDLERS.get(message.type, _broadcast_default)
             try:
-                message = json.loads(data)
-                message_type = message.get("type", "unknown")
-
-                # Original WebRTC handling + Screen sharing WebRTC
-                if message_type in ["webrtc-offer", "webrtc-answer", "ice-candidate",
-                                    "screen-share-offer", "screen-share-answer", "screen-share-ice-candidate"]:
-                    target_user = message.get("to_user")
-                    if target_user:
-                        message["from_user"] = user_id
-                        await manager.send_to_user(json.dumps(message), room_id, target_user)
-
-                elif message_type == "media-toggle":
-                    audio_enabled = message.get("audio_enabled", True)
-                    video_enabled = message.get("video_enabled", True)
-                    storage.update_media_status(room_id, user_id, audio_enabled, video_enabled)
-                    await manager.broadcast_to_room(
-                        json.dumps({"type": "user-media-changed", "user_id": user_id,
-                                    "audio_enabled": audio_enabled, "video_enabled": video_enabled}),
-                        room_id, exclude_user=user_id
-                    )
-
-                # Screen sharing status updates
-                elif message_type in ["screen-share-started", "screen-share-stopped"]:
-                    is_sharing = message_type == "screen-share-started"
-                    await manager.broadcast_to_room(
-                        json.dumps({"type": "user-screen-share-changed", "user_id": user_id,
-                                    "is_sharing": is_sharing}),
-                        room_id, exclude_user=user_id
-                    )
-                elif message_type == "recorder-offer":
-                    # { type:"recorder-offer", sdp:"...", sdpType:"offer" }
-                    sdp = message.get("sdp")
-                    sdp_type = message.get("sdpType", "offer")
-                    answer = await recorder.start_or_renegotiate(room_id, user_id, sdp, sdp_type)
-                    await websocket.send_text(json.dumps({
-                        "type": "recorder-answer",
-                        "sdp": answer["sdp"],
-                        "sdpType": answer["type"]
-                    }))
-
-                elif message_type == "recorder-ice-candidate":
-                    # { type:"recorder-ice-candidate", candidate: {candidate, sdpMid, sdpMLineIndex} | null }
-                    await recorder.add_ice(room_id, user_id, message.get("candidate"))
-
-                elif message_type == "recorder-stop":
-                    await recorder.stop(room_id, user_id)
-                    await websocket.send_text(json.dumps({"type": "recorder-stopped"}))
-
-                else:
-                    message["from_user"] = user_id
-                    await manager.broadcast_to_room(json.dumps(message), room_id, exclude_user=user_id)
-            except:
-                await websocket.send_text(json.dumps({"type": "error", "message": "Invalid JSON format"}))
+                await handler(message, data, room_id, user_id, websocket)
+            except WebSocketDisconnect:
+                raise
+            except Exception:
+                # a failing handler (e.g. recorder negotiation) shouldn't drop the signaling socket
+                logger.exception(f"Error handling {message.type} from user {user_id} in room {room_id}")
 
     except WebSocketDisconnect:
         pass
     finally:
-        try:
-            await recorder.stop(room_id, user_id)
-        except Exception:
-            pass
-        await manager.disconnect(websocket)
\ No newline at end of file
+        # Finalizing a recording can take a while; don't hold up the disconnect broadcast for it
+        task = asyncio.create_task(_safe_recorder_stop(room_id, user_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        await manager.disconnect(websocket)
@@ -1,10 +1,32 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from config import APP_NAME, APP_VERSION, ALLOWED_ORIGINS, logger
+from config import APP_NAME, APP_VERSION, ALLOWED_ORIGINS, STATIC_CACHE_CONTROL, logger
+from deps import storage
 from endpoints import rooms_endpoint, health_endpoint, websocket_routes_endpoint, pages_endpoint
 
-app = FastAPI(title=APP_NAME, version=APP_VERSION)
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that lets browsers keep assets instead of re-requesting them"""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = STATIC_CACHE_CONTROL
+        return response
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Room state is persisted write-behind; flush what's pending on shutdown
+    storage.start()
+    yield
+    await storage.stop()
+
+
+app = FastAPI(title=APP_NAME, version=APP_VERSION, default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -16,7 +38,7 @@ app.add_middleware(
 )
 
 # Static
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 # Routers
 app.include_router(rooms_endpoint.router)
@@ -26,7 +48,10 @@ app.include_router(pages_endpoint.router)
 
 if __name__ == "__main__":
     import uvicorn
-    from config import HOST, PORT, DEBUG
+    from config import HOST, PORT, DEBUG, WS_COMPRESS
 
     logger.info(f"Starting server on {HOST}:{PORT} (debug={DEBUG})")
-    uvicorn.run("main:app", host=HOST, port=PORT, reload=DEBUG)
+    # uvloop/httptools replace the pure-asyncio loop and HTTP parser. Stays single-worker:
+    # rooms and live sockets are held in process memory.
+    uvicorn.run("main:app", host=HOST, port=PORT, reload=DEBUG,
+                loop="uvloop", http="httptools", ws="websockets", ws_per_message_deflate=WS_COMPRESS)
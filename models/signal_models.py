@@ -0,0 +1,46 @@
+import sys
+from functools import lru_cache
+from typing import Optional
+
+import orjson
+from pydantic import BaseModel, ConfigDict
+
+
+class SignalMessage(BaseModel):
+    """Inbound WebSocket frame. Unknown fields are kept so relayed messages pass through intact"""
+    model_config = ConfigDict(extra="allow")
+
+    type: str = "unknown"
+    to_user: Optional[str] = None
+    audio_enabled: bool = True
+    video_enabled: bool = True
+    sdp: Optional[str] = None
+    sdpType: str = "offer"
+    candidate: Optional[dict] = None
+
+
+# Outbound message types. Hyphenated literals aren't auto-interned by CPython, so intern them
+# once and build every payload from the same string objects.
+MT_ROOM_JOINED = sys.intern("room-joined")
+MT_USER_SCREEN_SHARE_CHANGED = sys.intern("user-screen-share-changed")
+MT_RECORDER_ANSWER = sys.intern("recorder-answer")
+
+# Fixed-shape frames are filled in with %, skipping the dict and the generic encoder.
+# String values go in already JSON-encoded, so an id taken from a URL path can't break the frame.
+USER_LEFT_TMPL = b'{"type":"user-left","user_id":%b}'
+NEW_USER_JOINED_TMPL = (b'{"type":"new-user-joined","new_user":{"user_id":%b,"display_name":%b,'
+                        b'"audio_enabled":%b,"video_enabled":%b}}')
+USER_MEDIA_CHANGED_TMPL = b'{"type":"user-media-changed","user_id":%b,"audio_enabled":%b,"video_enabled":%b}'
+_JSON_BOOL = {True: b"true", False: b"false"}
+
+
+@lru_cache(maxsize=1024)
+def user_media_changed(user_id: str, audio_enabled: bool, video_enabled: bool) -> bytes:
+    """Encoded user-media-changed frame; users flip between a handful of states, so cache them"""
+    return USER_MEDIA_CHANGED_TMPL % (orjson.dumps(user_id), _JSON_BOOL[audio_enabled], _JSON_BOOL[video_enabled])
+
+
+def new_user_joined(user_id_json: bytes, display_name: str, audio_enabled: bool, video_enabled: bool) -> bytes:
+    """Encoded new-user-joined frame carrying the user's current media state"""
+    return NEW_USER_JOINED_TMPL % (user_id_json, orjson.dumps(display_name),
+                                   _JSON_BOOL[audio_enabled], _JSON_BOOL[video_enabled])
@@ -1,11 +1,12 @@
+import asyncio
 import os
-from threading import Lock
-import json
-import uuid
+import secrets
 from datetime import datetime
 from fastapi import HTTPException
 import logging
-from typing import List, Optional
+from typing import Dict, List, Optional
+
+import orjson
 
 # Configure logging
 
@@ -13,16 +14,36 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _now_iso() -> str:
+    """Timestamp for stored records; second precision skips the microsecond formatting"""
+    return datetime.now().isoformat(timespec="seconds")
+
+
 class FileStorageManager:
-    """File-based storage manager for rooms and participants"""
+    """File-based storage manager for rooms and participants.
+
+    The in-memory dicts are authoritative; the JSON files are a write-behind snapshot
+    taken by a background flusher (see start/stop) at most every FLUSH_INTERVAL seconds.
+    """
+
+    FLUSH_INTERVAL = 0.25  # seconds
 
     def __init__(self, data_dir="data"):
         self.data_dir = data_dir
         self.rooms_file = f"{data_dir}/rooms.json"
         self.participants_file = f"{data_dir}/participants.json"
-        self.file_lock = Lock()
+        # asyncio locks: every caller runs on the event loop, so waiting never blocks the loop.
+        # file_lock covers structural changes to the top-level dicts; the rest is per room.
+        self.file_lock = asyncio.Lock()
+        self._room_locks: Dict[str, asyncio.Lock] = {}
         self._ensure_data_dir()
 
+        self._rooms: dict = self._read_json(self.rooms_file)
+        self._participants: dict = self._read_json(self.participants_file)
+        self._dirty_files: set = set()  # snapshot files whose dict changed since the last flush
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None  # lets stop() end the flusher between flushes, never mid-write
+
     def _ensure_data_dir(self):
         """Create data directory and initialize files if they don't exist"""
         os.makedirs(self.data_dir, exist_ok=True)
@@ -36,128 +57,209 @@ class FileStorageManager:
     def _read_json(self, filepath: str) -> dict:
         """Safely read JSON file"""
         try:
-            with open(filepath, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+            with open(filepath, 'rb') as f:
+                return orjson.loads(f.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
             return {}
 
     def _write_json(self, filepath: str, data: dict):
         """Safely write JSON file"""
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2, default=str)
-
-    def create_room(self, max_participants: int = 100) -> str:
+        self._write_file(filepath, self._dump_json(data))
+
+    def _dump_json(self, data: dict) -> bytes:
+        """Serialize state for a snapshot, compact and pre-encoded"""
+        return orjson.dumps(data, default=str)
+
+    def _write_file(self, filepath: str, payload: bytes):
+        """Write an already-serialized snapshot in a single write() (runs in a worker thread).
+
+        The data goes to a temp file that is then renamed over the target, so a crash mid-write
+        leaves the previous snapshot intact instead of a truncated file.
+        """
+        tmp_path = filepath + ".tmp"
+        with open(tmp_path, 'wb', buffering=1 << 20) as f:
+            f.write(payload)
+        os.replace(tmp_path, filepath)
+
+    def _lock_for(self, room_id: str) -> asyncio.Lock:
+        """Per-room lock so mutations in unrelated rooms don't serialize on one another.
+
+        Only take it for a room that exists: the lock is dropped when the room is deleted,
+        so a lock made for an unknown id would never be freed.
+        """
+        # no await between the lookup and the insert, so this needs no lock of its own
+        lock = self._room_locks.get(room_id)
+        if lock is None:
+            lock = self._room_locks[room_id] = asyncio.Lock()
+        return lock
+
+    def start(self):
+        """Start the write-behind flusher on the running event loop"""
+        if self._flusher_task is None or self._flusher_task.done():
+            self._stopping = asyncio.Event()  # made here so it belongs to the loop that runs the flusher
+            self._flusher_task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        """Stop the flusher and write out anything still pending"""
+        if self._flusher_task is not None:
+            # Not cancelled: a flush in progress finishes its writes before the task returns
+            self._stopping.set()
+            await self._flusher_task
+            self._flusher_task = None
+        await self.flush()
+
+    async def _flusher(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to persist room state")
+
+    async def flush(self):
+        """Snapshot whichever files changed since the last flush, each written once"""
+        if not self._dirty_files:
+            return
+        # Serialize on the loop thread so the dicts can't change mid-dump; only file I/O is offloaded
+        async with self.file_lock:
+            snapshots = []
+            if self.rooms_file in self._dirty_files:
+                snapshots.append((self.rooms_file, self._dump_json(self._rooms)))
+            if self.participants_file in self._dirty_files:
+                snapshots.append((self.participants_file, self._dump_json(self._participants)))
+            self._dirty_files.clear()
+        for i, (filepath, payload) in enumerate(snapshots):
+            try:
+                await asyncio.to_thread(self._write_file, filepath, payload)
+            except BaseException:
+                # Not on disk yet: mark this file and the ones after it dirty again so the next flush retries
+                self._dirty_files.update(path for path, _ in snapshots[i:])
+                raise
+
+    async def create_room(self, max_participants: int = 100) -> str:
         """Create new room and return room_id"""
-        room_id = str(uuid.uuid4())[:8]
+        room_id = secrets.token_hex(4)
 
-        with self.file_lock:
-            rooms = self._read_json(self.rooms_file)
-            rooms[room_id] = {
+        async with self.file_lock:
+            self._rooms[room_id] = {
                 "room_id": room_id,
-                "created_at": datetime.now().isoformat(),
+                "created_at": _now_iso(),
                 "max_participants": max_participants,
                 "is_active": True,
                 "current_participants": 0
             }
-            self._write_json(self.rooms_file, rooms)
 
             # Initialize participants for this room
-            participants = self._read_json(self.participants_file)
-            participants[room_id] = {}
-            self._write_json(self.participants_file, participants)
+            self._participants[room_id] = {}
+            self._dirty_files.update((self.rooms_file, self.participants_file))
 
         logger.info(f"Created room {room_id} with max {max_participants} participants")
         return room_id
 
     def get_room(self, room_id: str) -> Optional[dict]:
         """Get room information"""
-        rooms = self._read_json(self.rooms_file)
-        return rooms.get(room_id)
+        return self._rooms.get(room_id)
 
-    def join_room(self, room_id: str, display_name: str) -> dict:
+    async def join_room(self, room_id: str, display_name: str) -> dict:
         """Add user to room, return user info"""
+        rooms = self._rooms
+        if room_id not in rooms:
+            raise HTTPException(status_code=404, detail="Room not found")
 
-        with self.file_lock:
-            # Check if room exists and has space
-            rooms = self._read_json(self.rooms_file)
+        async with self._lock_for(room_id):
+            # Re-check: the room may have been deleted while waiting for its lock
             if room_id not in rooms:
                 raise HTTPException(status_code=404, detail="Room not found")
 
-            # Load participants
-            participants = self._read_json(self.participants_file)
+            participants = self._participants
             if room_id not in participants:
-                participants[room_id] = {}
+                async with self.file_lock:
+                    participants[room_id] = {}
 
             # ✅ Check if same display_name already exists
             for uid, info in participants[room_id].items():
                 if info["display_name"] == display_name:
                     info["is_connected"] = True
-                    info["joined_at"] = datetime.now().isoformat()
-                    self._write_json(self.participants_file, participants)
+                    info["joined_at"] = _now_iso()
+                    self._dirty_files.add(self.participants_file)
                     return info
 
             # Else create new user
-            user_id = str(uuid.uuid4())[:8]
+            user_id = secrets.token_hex(4)
             user_info = {
                 "user_id": user_id,
                 "display_name": display_name,
-                "joined_at": datetime.now().isoformat(),
+                "joined_at": _now_iso(),
                 "is_audio_enabled": True,
                 "is_video_enabled": True,
                 "is_connected": True
             }
 
             participants[room_id][user_id] = user_info
-            self._write_json(self.participants_file, participants)
 
             # Update room participant count
             rooms[room_id]["current_participants"] += 1
-            self._write_json(self.rooms_file, rooms)
+            self._dirty_files.update((self.rooms_file, self.participants_file))
 
         logger.info(f"User {user_id} ({display_name}) joined room {room_id}")
         return user_info
 
-    def leave_room(self, room_id: str, user_id: str):
+    async def leave_room(self, room_id: str, user_id: str):
         """Remove user from room"""
-        with self.file_lock:
-            participants = self._read_json(self.participants_file)
-            rooms = self._read_json(self.rooms_file)
+        if user_id not in self._participants.get(room_id, {}):
+            return
+
+        async with self._lock_for(room_id):
+            participants = self._participants
+            rooms = self._rooms
 
             # Remove user from participants
             if room_id in participants and user_id in participants[room_id]:
                 del participants[room_id][user_id]
-                self._write_json(self.participants_file, participants)
+                self._dirty_files.add(self.participants_file)
 
                 # Update room participant count
                 if room_id in rooms:
+                    self._dirty_files.add(self.rooms_file)
                     rooms[room_id]["current_participants"] = max(0, rooms[room_id]["current_participants"] - 1)
 
-                    # Clean up empty rooms
+                    # Clean up empty rooms (room_id is known to be in participants here)
                     if rooms[room_id]["current_participants"] == 0:
-                        del rooms[room_id]
-                        if room_id in participants:
+                        async with self.file_lock:
+                            del rooms[room_id]
                             del participants[room_id]
-
-                    self._write_json(self.rooms_file, rooms)
-                    self._write_json(self.participants_file, participants)
+                            self._room_locks.pop(room_id, None)
 
         logger.info(f"User {user_id} left room {room_id}")
 
     def get_room_participants(self, room_id: str) -> List[dict]:
         """Get all users in a room"""
-        participants = self._read_json(self.participants_file)
-        if room_id not in participants:
+        if room_id not in self._participants:
             return []
-        return list(participants[room_id].values())
-
-    def update_media_status(self, room_id: str, user_id: str, audio_enabled: bool, video_enabled: bool):
-        """Update user's audio/video status"""
-        with self.file_lock:
-            participants = self._read_json(self.participants_file)
-            if room_id in participants and user_id in participants[room_id]:
-                participants[room_id][user_id]["is_audio_enabled"] = audio_enabled
-                participants[room_id][user_id]["is_video_enabled"] = video_enabled
-                self._write_json(self.participants_file, participants)
+        return list(self._participants[room_id].values())
+
+    def get_room_participants_map(self, room_id: str) -> dict:
+        """Get users in a room keyed by user_id"""
+        return self._participants.get(room_id, {})
+
+    async def update_media_status(self, room_id: str, user_id: str, audio_enabled: bool, video_enabled: bool) -> bool:
+        """Update user's audio/video status; returns False when nothing changed"""
+        if user_id not in self._participants.get(room_id, {}):
+            return False
+
+        async with self._lock_for(room_id):
+            user_info = self._participants.get(room_id, {}).get(user_id)
+            if user_info is None:
+                return False
+            if user_info["is_audio_enabled"] == audio_enabled and user_info["is_video_enabled"] == video_enabled:
+                return False
+            user_info["is_audio_enabled"] = audio_enabled
+            user_info["is_video_enabled"] = video_enabled
+            self._dirty_files.add(self.participants_file)
 
         logger.info(
             f"Updated media status for user {user_id} in room {room_id}: audio={audio_enabled}, video={video_enabled}")
+        return True
@@ -1,9 +1,12 @@
+import asyncio
 from typing import Dict
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import WebSocket
 
+from models.signal_models import MT_ROOM_JOINED, USER_LEFT_TMPL, new_user_joined
 from repos.file_storage_manager_repo import FileStorageManager
 import logging
-import json
+
+import orjson
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -12,12 +15,19 @@ logger = logging.getLogger(__name__)
 class ConnectionManager:
     """Enhanced connection manager with user tracking"""
 
+    OUTBOX_SIZE = 64  # frames queued per socket before it is treated as stalled and closed
+
     def __init__(self, storage: FileStorageManager):
         self.active_connections: Dict[str, Dict[str, WebSocket]] = {}  # {room_id: {user_id: websocket}}
-        self.user_to_room: Dict[WebSocket, tuple] = {}  # {websocket: (room_id, user_id)}
+        self.total_connections = 0  # kept in step with active_connections so /health stays O(1)
+        # {room_id: {user_id: {display_name, audio_enabled, video_enabled}}} for connected users,
+        # so room-joined is built without going back to storage
+        self.user_meta: Dict[str, Dict[str, dict]] = {}
         self.storage = storage
+        self._closing = set()  # holds close tasks for stalled sockets until they finish
 
-    async def connect(self, websocket: WebSocket, room_id: str, user_id: str, display_name: str):
+    async def connect(self, websocket: WebSocket, room_id: str, user_id: str, display_name: str,
+                      audio_enabled: bool = True, video_enabled: bool = True):
         """Connect user to room"""
         try:
             await websocket.accept()
@@ -29,26 +39,32 @@ class ConnectionManager:
         # Initialize room if it doesn't exist in active connections
         if room_id not in self.active_connections:
             self.active_connections[room_id] = {}
+            self.user_meta[room_id] = {}
 
         # Store connection
+        if user_id not in self.active_connections[room_id]:
+            self.total_connections += 1
         self.active_connections[room_id][user_id] = websocket
-        self.user_to_room[websocket] = (room_id, user_id)
+        # Per-connection bookkeeping lives on the socket's own state namespace, read back
+        # in disconnect, so no reverse-lookup dict is needed
+        state = websocket.state
+        state.room_id, state.user_id = room_id, user_id
+        state.user_id_json = orjson.dumps(user_id)  # encoded once, spliced into this user's join/leave frames
+        # Producers only enqueue; one writer per socket does the actual sends in order
+        state.outbox = asyncio.Queue(maxsize=self.OUTBOX_SIZE)
+        state.writer = asyncio.create_task(self._writer(websocket, room_id, user_id))
+
+        # Seeded from the stored media state; update_media keeps it current afterwards
+        room_meta = self.user_meta[room_id]
+        room_meta[user_id] = {"display_name": display_name, "audio_enabled": audio_enabled,
+                              "video_enabled": video_enabled}
 
         # Get existing users in room (exclude current user)
-        existing_users = []
-        participants = self.storage.get_room_participants(room_id)
-        for participant in participants:
-            if participant["user_id"] != user_id and participant["user_id"] in self.active_connections[room_id]:
-                existing_users.append({
-                    "user_id": participant["user_id"],
-                    "display_name": participant["display_name"],
-                    "audio_enabled": participant["is_audio_enabled"],
-                    "video_enabled": participant["is_video_enabled"]
-                })
+        existing_users = [{"user_id": uid, **meta} for uid, meta in room_meta.items() if uid != user_id]
 
         # Send room-joined message to new user
-        await websocket.send_text(json.dumps({
-            "type": "room-joined",
+        self.send(websocket, orjson.dumps({
+            "type": MT_ROOM_JOINED,
             "user_id": user_id,
             "room_id": room_id,
             "existing_users": existing_users,
@@ -57,15 +73,7 @@ class ConnectionManager:
 
         # Notify existing users about new user
         if existing_users:
-            new_user_message = json.dumps({
-                "type": "new-user-joined",
-                "new_user": {
-                    "user_id": user_id,
-                    "display_name": display_name,
-                    "audio_enabled": True,
-                    "video_enabled": True
-                }
-            })
+            new_user_message = new_user_joined(state.user_id_json, display_name, audio_enabled, video_enabled)
             await self.broadcast_to_room(new_user_message, room_id, exclude_user=user_id)
 
         logger.info(
@@ -74,54 +82,138 @@ class ConnectionManager:
 
     async def disconnect(self, websocket: WebSocket):
         """Disconnect user from room"""
-        if websocket in self.user_to_room:
-            room_id, user_id = self.user_to_room[websocket]
-
-            # Remove from active connections
-            if room_id in self.active_connections and user_id in self.active_connections[room_id]:
-                del self.active_connections[room_id][user_id]
-
-            del self.user_to_room[websocket]
+        state = websocket.state
+        room_id, user_id = getattr(state, "room_id", None), getattr(state, "user_id", None)
+        if room_id is not None:
+            state.room_id = state.user_id = None
+            state.writer.cancel()
+
+            # Remove from active connections, unless the user has already reconnected on a new socket
+            room = self.active_connections.get(room_id)
+            if room is not None:
+                current = room.get(user_id)
+                if current is websocket:
+                    del room[user_id]
+                    del self.user_meta[room_id][user_id]
+                    self.total_connections -= 1
+                elif current is not None:
+                    # a stale socket closing: the user is still here, so peers and storage keep them
+                    logger.info(f"Stale socket for user {user_id} in room {room_id} closed")
+                    return
 
             # Notify other users
-            user_left_message = json.dumps({
-                "type": "user-left",
-                "user_id": user_id
-            })
+            user_left_message = USER_LEFT_TMPL % state.user_id_json
             await self.broadcast_to_room(user_left_message, room_id, exclude_user=user_id)
 
             # Update storage
-            self.storage.leave_room(room_id, user_id)
+            await self.storage.leave_room(room_id, user_id)
 
-            # Clean up empty room
-            if room_id in self.active_connections and len(self.active_connections[room_id]) == 0:
+            # Clean up empty room (re-read: the room may have been dropped while awaiting)
+            room = self.active_connections.get(room_id)
+            if room is not None and not room:
                 del self.active_connections[room_id]
+                del self.user_meta[room_id]
 
             logger.info(f"User {user_id} disconnected from room {room_id}")
 
-    async def broadcast_to_room(self, message: str, room_id: str, exclude_user: str = None):
-        """Broadcast message to all users in room except excluded user"""
-        if room_id in self.active_connections:
-            disconnected = []
-            for user_id, connection in self.active_connections[room_id].items():
-                if user_id != exclude_user:
-                    try:
-                        await connection.send_text(message)
-                    except Exception as e:
-                        logger.error(f"Error sending message to user {user_id}: {e}")
-                        disconnected.append(user_id)
-
-            # Clean up disconnected users
-            for user_id in disconnected:
-                if user_id in self.active_connections[room_id]:
-                    del self.active_connections[room_id][user_id]
-
-    async def send_to_user(self, message: str, room_id: str, target_user: str):
-        """Send message to specific user in room"""
-        if room_id in self.active_connections and target_user in self.active_connections[room_id]:
+    async def _writer(self, websocket: WebSocket, room_id: str, user_id: str):
+        """Drain a socket's outbox; a None entry closes the socket once earlier frames are out"""
+        queue = websocket.state.outbox  # kept locally; send() clears it when cutting the socket loose
+        send = websocket.send  # bound once for the life of the connection
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    await websocket.close()
+                    return
+                # the ASGI message send_bytes would build, minus the wrapper call
+                await send({"type": "websocket.send", "bytes": message})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending message to user {user_id}: {e}")
+            # Clean up disconnected user
+            self._forget(websocket, room_id, user_id)
+
+    def _forget(self, websocket: WebSocket, room_id: str, user_id: str):
+        """Drop a dead socket from its room, unless the user has already reconnected on a new one"""
+        room = self.active_connections.get(room_id)
+        if room is not None and room.get(user_id) is websocket:
+            del room[user_id]
+            del self.user_meta[room_id][user_id]
+            self.total_connections -= 1
+
+    def update_media(self, room_id: str, user_id: str, audio_enabled: bool, video_enabled: bool):
+        """Keep the connected user's cached media state in step with storage"""
+        meta = self.user_meta.get(room_id, {}).get(user_id)
+        if meta is not None:
+            meta["audio_enabled"] = audio_enabled
+            meta["video_enabled"] = video_enabled
+
+    def send(self, websocket: WebSocket, message: bytes) -> bool:
+        """Queue an already-encoded payload on a connected socket without waiting for the send"""
+        state = websocket.state
+        queue = state.outbox
+        if queue is None:
+            return False  # already cut loose
+        try:
+            queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            # The client isn't reading; cut it loose instead of buffering without bound
+            state.outbox = None
+            room_id, user_id = state.room_id, state.user_id
+            logger.error(f"Outbox full for user {user_id} in room {room_id}, closing its socket")
+            state.writer.cancel()
+            self._forget(websocket, room_id, user_id)
+            task = asyncio.create_task(self._close_quietly(websocket, code=1013))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+            return False
+
+    async def close(self, websocket: WebSocket):
+        """Close a socket after the frames already queued for it have been sent"""
+        state = websocket.state
+        writer = state.writer
+        if state.outbox is not None and not writer.done():
             try:
-                await self.active_connections[room_id][target_user].send_text(message)
-            except Exception as e:
-                logger.error(f"Error sending message to user {target_user}: {e}")
-                # Clean up disconnected user
-                del self.active_connections[room_id][target_user]
+                state.outbox.put_nowait(None)
+                await asyncio.wait((writer,))
+                return
+            except asyncio.QueueFull:
+                writer.cancel()
+        await self._close_quietly(websocket)
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket, code: int = 1000):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def broadcast_to_room(self, message: bytes, room_id: str, exclude_user: str = None):
+        """Broadcast an already-encoded payload to all users in room except excluded user"""
+        room = self.active_connections.get(room_id)
+        if not room:
+            return
+        # Snapshot (a full outbox drops its socket from the room mid-loop), filtered up front
+        if exclude_user is None:
+            connections = tuple(room.values())
+        else:
+            connections = tuple(connection for user_id, connection in room.items() if user_id != exclude_user)
+        send = self.send
+        for connection in connections:
+            send(connection, message)
+
+    async def send_to_user(self, message: bytes, room_id: str, target_user: str):
+        """Send an already-encoded payload to specific user in room"""
+        connection = self.active_connections.get(room_id, {}).get(target_user)
+        if connection is not None:
+            self.send(connection, message)
+
+    def drop_room(self, room_id: str):
+        """Forget every connection in a room (sockets are expected to be closed already)"""
+        connections = self.active_connections.pop(room_id, None)
+        self.user_meta.pop(room_id, None)
+        if connections:
+            self.total_connections -= len(connections)
@@ -1,43 +1,140 @@
 # service/recorder_service.py
+import asyncio
 import os
-from datetime import datetime
-from typing import Dict, Tuple, Optional, Any
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Set, Tuple, Optional, Any
 
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate
+import av
+from aiortc import RTCConfiguration, RTCPeerConnection, RTCSessionDescription, RTCIceCandidate
 from aiortc.contrib.media import MediaRecorder
 import logging
 logger = logging.getLogger(__name__)
 
+
+# One ICE configuration for every recorder peer connection, built once
+_RTC_CONFIG = RTCConfiguration()
+
+
+def make_pc() -> RTCPeerConnection:
+    """Peer connection for a recorder session, using the shared configuration"""
+    return RTCPeerConnection(configuration=_RTC_CONFIG)
+
+
+def _finalize_container(container, streams, file):
+    # Flush buffered frames out of the encoders, then write the trailer and close the file
+    for stream in streams:
+        for packet in stream.encode(None):
+            container.mux(packet)
+    container.close()
+    file.close()
+
+
+class ThreadedMediaRecorder(MediaRecorder):
+    """
+    MediaRecorder whose stop() flushes and closes the container in a worker thread, so
+    finalizing an MP4 doesn't stall every other socket on the event loop.
+
+    The container writes through a Python file object with a large IO buffer, so muxed
+    packets reach the OS in buffer_size chunks instead of FFmpeg's default small writes.
+    """
+    def __init__(self, path: str, format: Optional[str] = None, options: Optional[Dict[str, str]] = None,
+                 buffer_size: int = 1 << 20):
+        # Set up what MediaRecorder.__init__ would, but open the container ourselves.
+        # Read access is needed too: +faststart re-reads the file to move the index up front.
+        self._file = open(path, "w+b")
+        self._MediaRecorder__container = av.open(self._file, mode="w", format=format, options=options,
+                                                 buffer_size=buffer_size)
+        self._MediaRecorder__tracks = {}
+
+    async def stop(self) -> None:
+        container = self._MediaRecorder__container
+        if container is None:
+            return
+        streams = []
+        readers = []
+        for context in self._MediaRecorder__tracks.values():
+            if context.task is not None:
+                context.task.cancel()
+                readers.append(context.task)
+                streams.append(context.stream)
+                context.task = None
+        self._MediaRecorder__tracks = {}
+        self._MediaRecorder__container = None
+        # let the cancelled track readers unwind before another thread touches their streams
+        if readers:
+            await asyncio.wait(readers)
+        await asyncio.to_thread(_finalize_container, container, streams, self._file)
+
+
 class RecorderSession:
     """
     One session per (room_id, user_id). Holds a single RTCPeerConnection and MediaRecorder.
     Supports renegotiation (e.g., adding/removing screen share later).
+    Tears itself down via on_dead if the peer connection fails/closes or no track arrives
+    within TRACK_TIMEOUT, so an abrupt client drop can't leak the PC and open file.
     """
-    def __init__(self, base_dir: str, room_id: str, user_id: str):
+    TRACK_TIMEOUT = 30  # seconds
+
+    # UTC minute prefix for file names, formatted once per minute rather than per session
+    _ts_minute = -1
+    _ts_prefix = ""
+
+    def __init__(self, base_dir: str, room_id: str, user_id: str,
+                 on_dead: Optional[Callable[[], Awaitable[None]]] = None):
         self.base_dir = base_dir
         self.room_id = room_id
         self.user_id = user_id
         self.pc: Optional[RTCPeerConnection] = None
         self.recorder: Optional[MediaRecorder] = None
         self.recorder_started = False
+        self.on_dead = on_dead or self.stop
+        self._tasks: Set[asyncio.Task] = set()  # watchdog / delayed start, cancelled in stop()
 
-        ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        ts = self._file_stem()
+        # created on the first track rather than here, so sessions that never record cost no mkdir
         self.out_dir = os.path.join(self.base_dir, room_id, user_id)
-        os.makedirs(self.out_dir, exist_ok=True)
         self.out_file = os.path.join(self.out_dir, f"{ts}.mp4")
 
+    def _open_recorder(self) -> "ThreadedMediaRecorder":
+        """Open the mp4 recorder, creating the output directory when it's missing"""
+        # use mp4 so default codecs (aac + libx264) are valid; faststart puts the
+        # index first so a finished recording plays before it fully downloads
+        try:
+            return ThreadedMediaRecorder(self.out_file, format="mp4", options={"movflags": "+faststart"})
+        except FileNotFoundError:
+            # first recording for this user, or the directory was cleaned since: create it and retry
+            os.makedirs(self.out_dir, exist_ok=True)
+            return ThreadedMediaRecorder(self.out_file, format="mp4", options={"movflags": "+faststart"})
+
+    @classmethod
+    def _file_stem(cls) -> str:
+        """e.g. 20261014T1530Z_0a3f9c2e1: minute prefix + hex ns within that minute, so names sort by start"""
+        now_ns = time.time_ns()
+        minute, ns_in_minute = divmod(now_ns, 60_000_000_000)
+        if minute != cls._ts_minute:
+            cls._ts_prefix = time.strftime("%Y%m%dT%H%MZ", time.gmtime(minute * 60))
+            cls._ts_minute = minute
+        return f"{cls._ts_prefix}_{ns_in_minute:09x}"
+
     async def _ensure_pc(self):
         if self.pc is not None:
             return
-        self.pc = RTCPeerConnection()
+        self.pc = make_pc()
+        self._spawn(self._track_watchdog())
+
+        @self.pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            if self.pc is not None and self.pc.connectionState in ("failed", "closed", "disconnected"):
+                logger.info(f"[recorder] connection {self.pc.connectionState} {self.room_id}/{self.user_id}")
+                await self.on_dead()
 
         @self.pc.on("track")
         async def on_track(track):
             logger.info(f"[recorder] track {track.kind} {self.room_id}/{self.user_id}")
             if self.recorder is None:
                 try:
-                    # use mp4 so default codecs (aac + libx264) are valid
-                    self.recorder = MediaRecorder(self.out_file, format="mp4")
+                    self.recorder = self._open_recorder()
                 except Exception as e:
                     logger.exception("[recorder] failed to create MediaRecorder: %s", e)
                     from aiortc.contrib.media import MediaBlackhole
@@ -61,7 +158,6 @@ class RecorderSession:
                         logger.exception("[recorder] failed to start recorder: %s", e)
                 elif track.kind == "audio":
                     # ✅ Delay audio-only start by 2s in case video comes later
-                    import asyncio
                     async def delayed_start():
                         await asyncio.sleep(2)
                         if not self.recorder_started:
@@ -72,12 +168,23 @@ class RecorderSession:
                             except Exception as e:
                                 logger.exception("[recorder] failed to start recorder: %s", e)
 
-                    asyncio.create_task(delayed_start())
+                    self._spawn(delayed_start())
 
             @track.on("ended")
             async def _ended():
                 logger.info(f"[recorder] {track.kind} ended {self.room_id}/{self.user_id}")
 
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _track_watchdog(self):
+        await asyncio.sleep(self.TRACK_TIMEOUT)
+        if self.recorder is None:
+            logger.info(f"[recorder] no track within {self.TRACK_TIMEOUT}s {self.room_id}/{self.user_id}")
+            await self.on_dead()
+
     async def start_or_renegotiate(self, offer_sdp: str, offer_type: str) -> Dict[str, Any]:
         await self._ensure_pc()
         # set remote (offer) and answer
@@ -101,9 +208,14 @@ class RecorderSession:
             await self.pc.addIceCandidate(None)
 
     async def stop(self):
-        # Close recorder first so file finalizes and is playable
+        current = asyncio.current_task()
+        for task in list(self._tasks):
+            if task is not current:
+                task.cancel()
+        # Close recorder first so file finalizes and is playable (an unstarted one just
+        # releases its file)
         try:
-            if self.recorder_started and self.recorder:
+            if self.recorder:
                 await self.recorder.stop()
         except Exception as e:
             logger.warning(f"[recorder] stop recorder error: {e}")
@@ -125,13 +237,17 @@ class RecorderManager:
         self.base_dir = base_dir
         os.makedirs(self.base_dir, exist_ok=True)
         self.sessions: Dict[Tuple[str, str], RecorderSession] = {}
+        # room_id -> user_ids with a session, so room teardown doesn't scan every session
+        self.room_index: Dict[str, Set[str]] = defaultdict(set)
 
     def _key(self, room_id: str, user_id: str): return (room_id, user_id)
 
     async def start_or_renegotiate(self, room_id: str, user_id: str, offer_sdp: str, offer_type: str):
         key = self._key(room_id, user_id)
         if key not in self.sessions:
-            self.sessions[key] = RecorderSession(self.base_dir, room_id, user_id)
+            self.sessions[key] = RecorderSession(self.base_dir, room_id, user_id,
+                                                 on_dead=lambda: self.stop(room_id, user_id))
+            self.room_index[room_id].add(user_id)
         return await self.sessions[key].start_or_renegotiate(offer_sdp, offer_type)
 
     async def add_ice(self, room_id: str, user_id: str, candidate: Optional[dict]):
@@ -140,12 +256,17 @@ class RecorderManager:
             await self.sessions[key].add_ice_candidate(candidate)
 
     async def stop(self, room_id: str, user_id: str):
-        key = self._key(room_id, user_id)
-        if key in self.sessions:
-            await self.sessions[key].stop()
-            del self.sessions[key]
+        session = self.sessions.pop(self._key(room_id, user_id), None)
+        if session is None:
+            return
+        users = self.room_index.get(room_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.room_index[room_id]
+        await session.stop()
 
     async def stop_all_in_room(self, room_id: str):
-        to_stop = [k for k in list(self.sessions.keys()) if k[0] == room_id]
-        for _, uid in to_stop:
-            await self.stop(room_id, uid)
+        # Each stop finalizes its own file and peer connection, so they can overlap
+        await asyncio.gather(*(self.stop(room_id, uid) for uid in list(self.room_index.get(room_id, ()))),
+                             return_exceptions=True)
@@ -36,6 +36,9 @@ const configuration = {
   ]
 };
 
+// Server frames arrive as binary (orjson bytes); decode them back to text
+const wsDecoder = new TextDecoder();
+
 // Global variables
 let ws = null;
 let localStream = null;
@@ -307,6 +310,7 @@ async function connectWebSocket() {
     }, 15000); // 15 second timeout
 
     ws = new WebSocket(wsUrl);
+    ws.binaryType = 'arraybuffer';
 
     ws.onopen = () => {
       console.log('WebSocket connected successfully');
@@ -334,7 +338,8 @@ async function connectWebSocket() {
 // Handle WebSocket messages
 async function handleWebSocketMessage(event) {
   try {
-    const message = JSON.parse(event.data);
+    const raw = typeof event.data === 'string' ? event.data : wsDecoder.decode(event.data);
+    const message = JSON.parse(raw);
     console.log('Received message:', message.type, message);
 
     switch (message.type) {
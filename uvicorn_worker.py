@@ -0,0 +1,10 @@
+from uvicorn.workers import UvicornWorker
+
+from config import WS_COMPRESS
+
+
+class SignalingUvicornWorker(UvicornWorker):
+    """Gunicorn worker with the same WebSocket settings as `python main.py`"""
+    # loop/http spelled out so a missing uvloop/httptools fails loudly instead of "auto" falling back
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "loop": "uvloop", "http": "httptools",
+                     "ws_per_message_deflate": WS_COMPRESS}